@@ -0,0 +1,447 @@
+import ast
+import base64
+import binascii
+from concurrent.futures import Future
+import hashlib
+import inspect
+import queue
+import threading
+import types
+
+# Functions every handler script must expose, with their minimum number of arguments
+REQUIRED_FUNCTIONS = {"load_model": 2, "generate": 2}
+
+# Maximum number of queued requests served together in one generate_batch call
+BATCH_MAX_SIZE = 32
+
+class ScriptValidationError(ValueError):
+    """
+    Raised when a handler script cannot be decoded, compiled or does not
+    expose the functions the runtime calls.
+    """
+
+class CompiledScript:
+    """
+    A validated handler script, imported once per content hash.
+
+    Attributes:
+        content_hash (str): SHA-256 of the decoded script source
+        loader_hash (str): Hash of load_model and everything it references,
+            used to decide whether a new script version can reuse loaded weights
+        module (module): The imported script module
+    """
+    def __init__(self, content_hash: str, loader_hash: str, module: types.ModuleType):
+        self.content_hash = content_hash
+        self.loader_hash = loader_hash
+        self.module = module
+
+class Handler:
+    """
+    A deployed script bound to its loaded model.
+
+    Requests queued with submit() are served by a worker thread, which takes
+    every request that queued up while the previous batch ran and serves them
+    with one generate_batch call. The worker exits once the handler is stopped.
+    """
+    def __init__(self, script: CompiledScript, model_key: tuple, model):
+        self.script = script
+        self.model_key = model_key
+        self.model = model
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._stopped = False
+
+    def generate_batch(self, input_texts: list, **kwargs) -> list:
+        """
+        Run requests through the script's generate_batch when it defines one,
+        otherwise through generate one at a time.
+        """
+        module = self.script.module
+        if callable(getattr(module, "generate_batch", None)):
+            return module.generate_batch(self.model, input_texts, **kwargs)
+        return [module.generate(self.model, input_text, **kwargs) for input_text in input_texts]
+
+    def submit(self, input_text: str) -> Future:
+        """
+        Queue a request to be batched with other queued requests.
+
+        Returns:
+            Future: Resolves to the response for this request
+        """
+        future = Future()
+        with self._worker_lock:
+            if not self._stopped:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name="handler-batch-worker", daemon=True)
+                    self._worker.start()
+                self._queue.put((input_text, future))
+                return future
+
+        # Replaced while the request was on its way: serve it directly
+        self._serve([(input_text, future)])
+        return future
+
+    def stop(self):
+        """
+        Stop the worker once the requests already queued have been served.
+        """
+        with self._worker_lock:
+            self._stopped = True
+            self._queue.put(None)
+
+    def _run(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            requests = [request]
+            stopping = False
+            while len(requests) < BATCH_MAX_SIZE:
+                try:
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                requests.append(request)
+            self._serve(requests)
+            if stopping:
+                return
+
+    def _serve(self, requests: list):
+        # Resolve every future, whatever generate_batch does
+        try:
+            responses = self.generate_batch([input_text for input_text, _ in requests])
+        except BaseException as e:
+            for _, future in requests:
+                future.set_exception(e)
+            return
+        for (_, future), response in zip(requests, responses):
+            future.set_result(response)
+        for _, future in requests[len(responses):]:
+            future.set_exception(RuntimeError(
+                f"generate_batch returned {len(responses)} responses for {len(requests)} requests"
+            ))
+
+def decode_script(custom_script: str) -> str:
+    """
+    Decode a base64 encoded script, as stored in ModelScript.content.
+
+    Args:
+        custom_script (str): Base64 encoded script source
+
+    Returns:
+        str: The script source
+    """
+    try:
+        return base64.b64decode(custom_script, validate=True).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ScriptValidationError(f"Script is not valid base64 encoded UTF-8: {e}") from e
+
+def _bound_names(node: ast.AST) -> set:
+    """
+    Names a statement binds or mutates anywhere inside it: assignment targets,
+    augmented assignments, loop and with targets, imports and definitions.
+    """
+    names = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and isinstance(child.ctx, (ast.Store, ast.Del)):
+            names.add(child.id)
+        elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(child.name)
+        elif isinstance(child, (ast.Import, ast.ImportFrom)):
+            for alias in child.names:
+                names.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(child, ast.ExceptHandler) and child.name:
+            names.add(child.name)
+        elif isinstance(child, (ast.Assign, ast.AugAssign)):
+            targets = child.targets if isinstance(child, ast.Assign) else [child.target]
+            for target in targets:
+                if isinstance(target, (ast.Subscript, ast.Attribute)):
+                    names.update(n.id for n in ast.walk(target) if isinstance(n, ast.Name))
+    return names
+
+def _loader_hash(tree: ast.Module, content_hash: str) -> str:
+    """
+    Hash load_model together with the imported names and module-level
+    definitions it references (transitively). Line numbers are ignored, so
+    edits elsewhere in the script, e.g. to generate or its imports, keep the
+    same hash.
+
+    If load_model reaches a name that is also bound or mutated somewhere this
+    walk doesn't track (inside a module-level if/try/with/for, by augmented or
+    subscript assignment, or through a global statement), the full content
+    hash is returned, so any change to the script reloads the weights.
+    """
+    definitions = {}
+    untracked = set()
+    for function in ast.walk(tree):
+        if isinstance(function, ast.Global):
+            untracked.update(function.names)
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                bound_name = alias.asname or alias.name.split(".")[0]
+                definitions[bound_name] = f"import {alias.name} as {bound_name}"
+        elif isinstance(node, ast.ImportFrom):
+            for alias in node.names:
+                bound_name = alias.asname or alias.name
+                definitions[bound_name] = f"from {'.' * node.level}{node.module or ''} import {alias.name} as {bound_name}"
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            definitions[node.name] = node
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                for name in ast.walk(target):
+                    if not isinstance(name, ast.Name):
+                        continue
+                    if isinstance(name.ctx, ast.Store):
+                        definitions[name.id] = node
+                    else:
+                        # Base of a subscript or attribute assignment, e.g. os.environ[...] = ...
+                        untracked.add(name.id)
+        else:
+            untracked.update(_bound_names(node))
+            if isinstance(node, ast.Expr):
+                # Module-level calls may mutate what they touch, e.g. os.environ.update(...)
+                untracked.update(n.id for n in ast.walk(node) if isinstance(n, ast.Name))
+
+    digest = hashlib.sha256()
+    seen = set()
+    pending = ["load_model"]
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        if name in untracked:
+            return content_hash
+        node = definitions.get(name)
+        if node is None:
+            continue
+        seen.add(name)
+        if isinstance(node, str):
+            # Imported name: nothing further to follow
+            digest.update(node.encode("utf-8"))
+            continue
+        digest.update(ast.dump(node).encode("utf-8"))
+        pending.extend(sorted(
+            child.id for child in ast.walk(node)
+            if isinstance(child, ast.Name) and child.id not in seen
+        ))
+
+    return digest.hexdigest()
+
+def compile_script(source: str, content_hash: str) -> CompiledScript:
+    """
+    Compile and import a handler script and check that it exposes
+    load_model(model_name, model_revision) and generate(model, input_text).
+
+    Args:
+        source (str): The script source
+        content_hash (str): SHA-256 of the script source
+
+    Returns:
+        CompiledScript: The validated script
+    """
+    try:
+        tree = ast.parse(source, filename=f"<handler {content_hash[:12]}>")
+        code = compile(tree, f"<handler {content_hash[:12]}>", "exec")
+    except SyntaxError as e:
+        raise ScriptValidationError(f"Script has a syntax error: {e}") from e
+
+    module = types.ModuleType(f"handler_{content_hash[:12]}")
+    try:
+        exec(code, module.__dict__)
+    except KeyboardInterrupt:
+        raise
+    except BaseException as e:
+        # Includes SystemExit, so a script calling sys.exit() can't stop the runtime
+        raise ScriptValidationError(f"Script failed to import: {e!r}") from e
+
+    for name, arg_count in REQUIRED_FUNCTIONS.items():
+        function = getattr(module, name, None)
+        if not callable(function):
+            raise ScriptValidationError(f"Script must define a {name} function")
+        try:
+            inspect.signature(function).bind(*([None] * arg_count))
+        except TypeError as e:
+            raise ScriptValidationError(f"{name} must accept {arg_count} positional arguments") from e
+
+    return CompiledScript(content_hash, _loader_hash(tree, content_hash), module)
+
+class HandlerRuntime:
+    """
+    Keeps deployed handler scripts and their loaded models in memory.
+
+    Scripts are decoded, imported and validated once per content hash. Loaded
+    models are shared by key (model name, revision, loader hash), so deploying
+    a new version of a script only reloads weights when load_model changed.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scripts = {}    # content hash -> CompiledScript
+        self._compiling = {}  # content hash -> Future of a compile in progress
+        self._models = {}     # model key -> loaded model
+        self._loading = {}    # model key -> Future of a load in progress
+        self._handlers = {}  # deployment name -> Handler
+
+    def get_script(self, custom_script: str) -> CompiledScript:
+        """
+        Return the compiled script for base64 encoded content, compiling it on first use.
+
+        Args:
+            custom_script (str): Base64 encoded script source
+
+        Returns:
+            CompiledScript: The validated script
+        """
+        source = decode_script(custom_script)
+        content_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        return self._single_flight(
+            self._scripts, self._compiling, content_hash,
+            lambda: compile_script(source, content_hash)
+        )
+
+    def deploy(self, deployment_name: str, model_name: str, model_revision: str, custom_script: str) -> Handler:
+        """
+        Deploy a script for a model, or hot-swap the script of an existing deployment.
+        In-flight requests finish on the previous handler.
+
+        Args:
+            deployment_name (str): Unique name of the deployment (model_unique_name)
+            model_name (str): The name of the model on Hugging Face
+            model_revision (str): The revision/branch of the model
+            custom_script (str): Base64 encoded script source
+
+        Returns:
+            Handler: The active handler for the deployment
+        """
+        script = self.get_script(custom_script)
+        model_key = (model_name, model_revision, script.loader_hash)
+
+        model = self._get_model(script, model_key)
+
+        handler = Handler(script, model_key, model)
+        with self._lock:
+            # Re-register the model and script in case another deploy released them meanwhile
+            self._models.setdefault(model_key, model)
+            self._scripts.setdefault(script.content_hash, script)
+            previous = self._handlers.get(deployment_name)
+            self._handlers[deployment_name] = handler
+            self._release_unused()
+        if previous is not None:
+            previous.stop()
+        return handler
+
+    def undeploy(self, deployment_name: str):
+        """
+        Remove a deployment and release its model and script if nothing else uses them.
+        """
+        with self._lock:
+            previous = self._handlers.pop(deployment_name, None)
+            self._release_unused()
+        if previous is not None:
+            previous.stop()
+
+    def generate(self, deployment_name: str, input_text: str, **kwargs) -> str:
+        """
+        Run a single request through the deployment's active handler. Extra
+        keyword arguments are passed to the script's generate as per-request
+        options, e.g. max_new_tokens or stop for text generation.
+        """
+        handler = self._get_handler(deployment_name)
+        return handler.script.module.generate(handler.model, input_text, **kwargs)
+
+    def generate_with_details(self, deployment_name: str, input_text: str, **kwargs) -> dict:
+        """
+        Run a single request and return the script's details, e.g. the stop
+        reason for text generation, when the script defines generate_with_details.
+        Other scripts return only the text, with no stop reason.
+        """
+        handler = self._get_handler(deployment_name)
+        module = handler.script.module
+        if callable(getattr(module, "generate_with_details", None)):
+            return module.generate_with_details(handler.model, input_text, **kwargs)
+        return {"text": module.generate(handler.model, input_text, **kwargs), "stop_reason": None}
+
+    def generate_batch(self, deployment_name: str, input_texts: list, **kwargs) -> list:
+        """
+        Run a list of requests through the deployment's active handler, using the
+        script's generate_batch when it defines one. Extra keyword arguments
+        are passed on as per-request options.
+        """
+        return self._get_handler(deployment_name).generate_batch(input_texts, **kwargs)
+
+    def submit(self, deployment_name: str, input_text: str) -> Future:
+        """
+        Queue a request on the deployment's active handler. Requests queued
+        while a batch runs are served together with one generate_batch call.
+
+        Returns:
+            Future: Resolves to the response for this request
+        """
+        return self._get_handler(deployment_name).submit(input_text)
+
+    def _get_model(self, script: CompiledScript, model_key: tuple):
+        model_name, model_revision, _ = model_key
+        return self._single_flight(
+            self._models, self._loading, model_key,
+            lambda: script.module.load_model(model_name, model_revision)
+        )
+
+    def _single_flight(self, cache: dict, in_flight: dict, key, create):
+        # Create each key once; concurrent callers for the same key wait for that call
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                return value
+            pending = in_flight.get(key)
+            if pending is None:
+                pending = in_flight[key] = Future()
+                is_creator = True
+            else:
+                is_creator = False
+
+        if not is_creator:
+            return pending.result()
+
+        try:
+            value = create()
+        except BaseException as e:
+            with self._lock:
+                del in_flight[key]
+            pending.set_exception(e)
+            raise
+
+        with self._lock:
+            cache[key] = value
+            del in_flight[key]
+        pending.set_result(value)
+        return value
+
+    def _get_handler(self, deployment_name: str) -> Handler:
+        with self._lock:
+            handler = self._handlers.get(deployment_name)
+        if handler is None:
+            raise KeyError(f"No handler deployed for {deployment_name}")
+        return handler
+
+    def _release_unused(self):
+        # Drop models and scripts no deployment refers to any more; callers hold the lock
+        model_keys = {handler.model_key for handler in self._handlers.values()}
+        content_hashes = {handler.script.content_hash for handler in self._handlers.values()}
+        released = [key for key in self._models if key not in model_keys]
+        for key in released:
+            del self._models[key]
+        for content_hash in [h for h in self._scripts if h not in content_hashes]:
+            del self._scripts[content_hash]
+
+        if released:
+            try:
+                import torch
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            except ImportError:
+                pass
@@ -0,0 +1,325 @@
+from transformers import (
+    AutoConfig,
+    AutoModel,
+    AutoModelForQuestionAnswering,
+    AutoModelForSequenceClassification,
+    AutoModelForTokenClassification,
+    AutoTokenizer,
+)
+from transformers.utils import cached_file
+from safetensors import safe_open
+from contextlib import contextmanager
+import json
+import threading
+import torch
+import warnings
+
+# Task heads attached to the shared backbone. Each entry maps a task name to
+# the model class of the head and the subfolder of the model repository that
+# holds its fine-tuned safetensors checkpoint. Heads whose subfolder is missing,
+# or whose backbone weights differ from the shared backbone, are skipped. The backbone is loaded from the repository root, so the heads
+# must have been trained on top of the same backbone weights.
+TASK_HEADS = {
+    "text-classification": (AutoModelForSequenceClassification, "text-classification"),
+    "token-classification": (AutoModelForTokenClassification, "token-classification"),
+    "question-answering": (AutoModelForQuestionAnswering, "question-answering"),
+}
+
+# Tasks whose input is a (question, context) pair rather than a single text
+PAIR_TASKS = {"question-answering"}
+
+# Check that the backbone weights stored with each head match the shared
+# backbone, so a head fine-tuned end-to-end is refused instead of silently
+# running on different weights. Backbone tensors are read one at a time.
+VERIFY_SHARED_BACKBONE = True
+
+class SharedBackbone(torch.nn.Module):
+    """
+    Wraps the backbone shared by all task heads. Inside reuse(inputs), the
+    backbone runs once and heads called with exactly those input tensors get
+    that output instead of running it again. The output is kept per thread, so
+    concurrent requests never see each other's outputs.
+    """
+    def __init__(self, backbone):
+        super().__init__()
+        self.backbone = backbone
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        # Task models may reach into their backbone (embeddings, config, ...)
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self.backbone, name)
+
+    @contextmanager
+    def reuse(self, inputs: dict):
+        """
+        Run the backbone once on inputs and serve that output to the heads
+        called with the same tensors until the block exits.
+        """
+        self._local.inputs = inputs
+        self._local.output = self.backbone(**inputs)
+        try:
+            yield self._local.output
+        finally:
+            self._local.inputs = None
+            self._local.output = None
+
+    def forward(self, *args, **kwargs):
+        if self._matches_reused(args, kwargs):
+            return self._local.output
+        return self.backbone(*args, **kwargs)
+
+    def _matches_reused(self, args: tuple, kwargs: dict) -> bool:
+        # The call must pass the very tensors given to reuse() and nothing
+        # else that changes the output (masks, embeddings, extra outputs)
+        reused = getattr(self._local, "inputs", None)
+        if reused is None or len(args) > 1:
+            return False
+        call = dict(kwargs)
+        if args:
+            call["input_ids"] = args[0]
+        for name, value in call.items():
+            if name in reused:
+                if value is not reused[name]:
+                    return False
+            elif name != "return_dict" and value is not None and value is not False:
+                return False
+        return all(call.get(name) is value for name, value in reused.items())
+
+def _checkpoint_files(model_name: str, model_revision: str, subfolder: str) -> list:
+    """
+    Resolve the safetensors files of a head checkpoint, single-file or sharded.
+
+    Raises:
+        OSError: If the subfolder has no safetensors checkpoint
+    """
+    try:
+        return [cached_file(model_name, "model.safetensors", revision=model_revision, subfolder=subfolder)]
+    except OSError:
+        pass
+
+    index_file = cached_file(model_name, "model.safetensors.index.json", revision=model_revision, subfolder=subfolder)
+    with open(index_file) as f:
+        shards = sorted(set(json.load(f)["weight_map"].values()))
+    return [cached_file(model_name, shard, revision=model_revision, subfolder=subfolder) for shard in shards]
+
+def _load_head(task: str, model_class, model_name: str, model_revision: str, subfolder: str, shared: SharedBackbone):
+    """
+    Build a task model around the shared backbone and load only its head
+    weights from the checkpoint. The task model is created on the meta device,
+    so its own copy of the backbone is never allocated.
+
+    Raises:
+        OSError: If the head checkpoint doesn't exist
+        ValueError: If the head was trained on different backbone weights
+    """
+    config = AutoConfig.from_pretrained(
+        model_name,
+        revision=model_revision,
+        subfolder=subfolder,
+        trust_remote_code=True
+    )
+    checkpoint_files = _checkpoint_files(model_name, model_revision, subfolder)
+
+    with torch.device("meta"):
+        task_model = model_class.from_config(config, torch_dtype=torch.float16, trust_remote_code=True)
+    backbone_prefix = task_model.base_model_prefix + "."
+    setattr(task_model, task_model.base_model_prefix, shared)
+
+    # Read the head weights and compare the stored backbone weights with the shared backbone
+    backbone_state = shared.backbone.state_dict()
+    head_state = {}
+    for checkpoint_file in checkpoint_files:
+        with safe_open(checkpoint_file, framework="pt") as f:
+            for name in f.keys():
+                if not name.startswith(backbone_prefix):
+                    head_state[name] = f.get_tensor(name).to(torch.float16)
+                    continue
+                shared_tensor = backbone_state.get(name[len(backbone_prefix):])
+                if VERIFY_SHARED_BACKBONE and shared_tensor is not None:
+                    stored_tensor = f.get_tensor(name).to(shared_tensor.device, shared_tensor.dtype)
+                    if not torch.equal(stored_tensor, shared_tensor):
+                        raise ValueError(
+                            f"The {task} head was trained with different backbone weights ({name}); "
+                            f"it can't share the backbone from the repository root"
+                        )
+
+    task_model.load_state_dict(head_state, strict=False, assign=True)
+    missing = [name for name, tensor in task_model.state_dict().items() if tensor.is_meta]
+    if missing:
+        raise ValueError(f"The {task} head checkpoint is missing weights: {', '.join(missing)}")
+
+    return task_model.to(shared.backbone.device).eval()
+
+def load_model(model_name: str, model_revision: str):
+    """
+    Load the backbone once and attach the task heads listed in TASK_HEADS.
+    Only the head weights are read from each head checkpoint, so every
+    additional task keeps just its head resident.
+
+    Args:
+        model_name (str): The name of the model on Hugging Face
+        model_revision (str): The revision/branch of the model
+
+    Returns:
+        tuple: (shared backbone, task heads by task name, tokenizer)
+    """
+    # Load tokenizer
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_name,
+        revision=model_revision,
+        use_fast=True,
+        trust_remote_code=True
+    )
+
+    # Load the shared backbone
+    backbone = AutoModel.from_pretrained(
+        model_name,
+        revision=model_revision,
+        device_map="auto",
+        torch_dtype=torch.float16,
+        trust_remote_code=True,
+        low_cpu_mem_usage=True
+    ).eval()
+
+    # Move backbone to GPU if available
+    if torch.cuda.is_available():
+        backbone = backbone.to("cuda")
+
+    shared = SharedBackbone(backbone)
+
+    # Load each task head present in the repository and attach it to the shared backbone
+    heads = {}
+    for task, (model_class, subfolder) in TASK_HEADS.items():
+        try:
+            heads[task] = _load_head(task, model_class, model_name, model_revision, subfolder, shared)
+        except OSError as e:
+            warnings.warn(f"Skipping the {task} head: no checkpoint in {subfolder}/ ({e})")
+        except ValueError as e:
+            warnings.warn(f"Skipping the {task} head: {e}")
+
+    if not heads:
+        raise OSError(
+            f"No task head could be attached in {model_name}; expected a checkpoint sharing "
+            "the root backbone in one of the subfolders: "
+            + ", ".join(subfolder for _, subfolder in TASK_HEADS.values())
+        )
+
+    return shared, heads, tokenizer
+
+def _classify_text(head, logits) -> str:
+    probabilities = torch.nn.functional.softmax(logits[0].float(), dim=-1)
+    top_prob, top_indices = torch.topk(probabilities, min(3, probabilities.shape[-1]))
+    results = [
+        f"{head.config.id2label[idx]}: {prob:.2%}"
+        for prob, idx in zip(top_prob.tolist(), top_indices.tolist())
+    ]
+    return "Predictions:\n" + "\n".join(results)
+
+def _extract_entities(head, logits, input_text: str, offset_mapping: list) -> str:
+    predictions = torch.argmax(logits[0], dim=-1).tolist()
+    results = []
+    current_entity = None
+    current_text = ""
+
+    for pred, (start, end) in zip(predictions, offset_mapping):
+        if start == 0 and end == 0:  # Skip special tokens
+            continue
+
+        label = head.config.id2label[pred]
+        token_text = input_text[start:end]
+
+        if label.startswith("B-"):  # Beginning of entity
+            if current_entity:
+                results.append(f"{current_entity}: {current_text.strip()}")
+            current_entity = label[2:]
+            current_text = token_text
+        elif label.startswith("I-"):  # Inside entity
+            if current_entity and current_entity == label[2:]:
+                current_text += " " + token_text
+        else:  # O (Outside) or other
+            if current_entity:
+                results.append(f"{current_entity}: {current_text.strip()}")
+                current_entity = None
+                current_text = ""
+
+    # Add the last entity if exists
+    if current_entity:
+        results.append(f"{current_entity}: {current_text.strip()}")
+
+    return "Entities:\n" + "\n".join(results)
+
+def _answer_question(outputs, context: str, offset_mapping: list) -> str:
+    start_probs = torch.nn.functional.softmax(outputs.start_logits[0].float(), dim=-1)
+    end_probs = torch.nn.functional.softmax(outputs.end_logits[0].float(), dim=-1)
+    start_score, start_idx = start_probs.max(dim=-1)
+    end_score, end_idx = end_probs.max(dim=-1)
+
+    answer_start = offset_mapping[start_idx.item()][0]
+    answer_end = offset_mapping[end_idx.item()][1]
+    confidence = (start_score.item() + end_score.item()) / 2
+
+    return f"Answer: {context[answer_start:answer_end]}\nConfidence: {confidence:.2%}"
+
+def generate(model, input_text: str) -> str:
+    """
+    Run every applicable task head on the input text with a single backbone pass.
+    Inputs in the format "question: [question] context: [context]" are answered
+    by the pair tasks (question answering); all other inputs go to the single-text
+    tasks (text and token classification).
+
+    Args:
+        model (tuple): The shared backbone, task heads and tokenizer
+        input_text (str): The input text
+
+    Returns:
+        str: The results of each task head
+    """
+    shared, heads, tokenizer = model  # Unpack the backbone, heads and tokenizer
+
+    # Parse input text
+    if "context:" in input_text:
+        question, context = input_text.split("context:", 1)
+        question = question.replace("question:", "").strip()
+        context = context.strip()
+        texts = (question, context)
+        tasks = [task for task in heads if task in PAIR_TASKS]
+    else:
+        texts = (input_text,)
+        tasks = [task for task in heads if task not in PAIR_TASKS]
+
+    if not tasks:
+        return f"Error: No task head deployed for this input format. Available tasks: {', '.join(heads)}"
+
+    # Tokenize input
+    inputs = tokenizer(
+        *texts,
+        return_tensors="pt",
+        truncation=True,
+        max_length=512,
+        add_special_tokens=True,
+        return_offsets_mapping=True
+    )
+    offset_mapping = inputs.pop("offset_mapping")[0].tolist()
+    inputs = dict(inputs)
+
+    # Move inputs to GPU if available
+    if torch.cuda.is_available():
+        inputs = {k: v.to("cuda") for k, v in inputs.items()}
+
+    # Get predictions; the backbone runs once and each head reuses its output
+    results = []
+    with torch.no_grad(), torch.amp.autocast('cuda'), shared.reuse(inputs):
+        for task in tasks:
+            head = heads[task]
+            outputs = head(**inputs)
+            if task == "text-classification":
+                results.append(_classify_text(head, outputs.logits))
+            elif task == "token-classification":
+                results.append(_extract_entities(head, outputs.logits, input_text, offset_mapping))
+            elif task == "question-answering":
+                results.append(_answer_question(outputs, texts[1], offset_mapping))
+
+    return f"Input: {input_text}\n\n" + "\n\n".join(results)
@@ -1,5 +1,25 @@
 from transformers import AutoModelForQuestionAnswering, AutoTokenizer
+from collections import OrderedDict
+from functools import lru_cache
+import hashlib
+import threading
+import time
 import torch
+import weakref
+
+# Maximum number of encodings kept in each tokenizer's cache
+TOKEN_CACHE_SIZE = 4096
+
+# Encodings of recently seen inputs per tokenizer, keyed by content hash (LRU
+# order). Keyed weakly by the tokenizer object, so deployments of different
+# revisions never share token ids and a released tokenizer drops its cache.
+_token_caches = weakref.WeakKeyDictionary()
+
+# Guards the tokenization caches and metrics, which are shared by concurrent requests
+_token_cache_lock = threading.Lock()
+
+# Tokenization metrics, exposed through get_tokenization_metrics()
+_tokenization_metrics = {"calls": 0, "inputs": 0, "cache_hits": 0, "seconds": 0.0}
 
 def load_model(model_name: str, model_revision: str):
     """
@@ -36,64 +56,188 @@ def load_model(model_name: str, model_revision: str):
     
     return model, tokenizer
 
-def generate(model, input_text: str) -> str:
+def _cache_key(text, text_pair, kwargs) -> str:
     """
-    Answer questions based on the input text.
-    The input text should be in the format: "question: [question] context: [context]"
+    Build the cache key for one input from its content and the tokenizer arguments.
+    """
+    digest = hashlib.sha1()
+    for part in (repr(sorted(kwargs.items())), text, text_pair or ""):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def tokenize_batch(tokenizer, input_texts: list, text_pairs: list = None, **kwargs) -> list:
+    """
+    Tokenize a batch of inputs with a single call to the fast tokenizer.
+    Encodings of repeated inputs are served from an LRU cache keyed by content hash.
+    
+    Args:
+        tokenizer: The loaded fast tokenizer
+        input_texts (list): The input texts to tokenize
+        text_pairs (list, optional): Second sequences to encode with each input
+        **kwargs: Extra arguments forwarded to the tokenizer
+    
+    Returns:
+        list: One encoding (dict of token id lists) per input
+    """
+    start_time = time.perf_counter()
+    pairs = text_pairs if text_pairs is not None else [None] * len(input_texts)
+    keys = [_cache_key(text, pair, kwargs) for text, pair in zip(input_texts, pairs)]
+    
+    # Look up cached encodings, collecting the first occurrence of each miss
+    encodings = {}
+    misses = {}
+    cache_hits = 0
+    with _token_cache_lock:
+        token_cache = _token_caches.setdefault(tokenizer, OrderedDict())
+        for i, key in enumerate(keys):
+            encoding = token_cache.get(key)
+            if encoding is not None:
+                token_cache.move_to_end(key)
+                encodings[key] = encoding
+                cache_hits += 1
+            elif key not in misses:
+                misses[key] = i
+    
+    # Encode all misses through the batch API in one call
+    if misses:
+        batch = tokenizer(
+            [input_texts[i] for i in misses.values()],
+            [pairs[i] for i in misses.values()] if text_pairs is not None else None,
+            truncation=True,
+            add_special_tokens=True,
+            **kwargs
+        )
+        for j, key in enumerate(misses):
+            encodings[key] = {name: values[j] for name, values in batch.items()}
+    
+    with _token_cache_lock:
+        for key in misses:
+            token_cache[key] = encodings[key]
+        while len(token_cache) > TOKEN_CACHE_SIZE:
+            token_cache.popitem(last=False)
+        
+        _tokenization_metrics["calls"] += 1
+        _tokenization_metrics["inputs"] += len(keys)
+        _tokenization_metrics["cache_hits"] += cache_hits
+        _tokenization_metrics["seconds"] += time.perf_counter() - start_time
+    
+    return [encodings[key] for key in keys]
+
+def collate(tokenizer, encodings: list) -> dict:
+    """
+    Pad a list of encodings into a batch of tensors.
+    Offset mappings are left out, since they are only needed on the CPU side.
+    
+    Args:
+        tokenizer: The loaded fast tokenizer
+        encodings (list): Encodings returned by tokenize_batch
+    
+    Returns:
+        dict: Padded input tensors for the model
+    """
+    features = [
+        {name: values for name, values in encoding.items() if name != "offset_mapping"}
+        for encoding in encodings
+    ]
+    inputs = tokenizer.pad(features, padding=True, return_tensors="pt")
+    
+    # Move inputs to GPU if available
+    if torch.cuda.is_available():
+        inputs = {k: v.to("cuda") for k, v in inputs.items()}
+    
+    return inputs
+
+def get_tokenization_metrics() -> dict:
+    """
+    Return the tokenization time and cache statistics collected so far.
+    
+    Returns:
+        dict: Calls, inputs, cache hits and total/average tokenization time in milliseconds
+    """
+    with _token_cache_lock:
+        metrics = dict(_tokenization_metrics)
+        metrics["cache_size"] = sum(len(token_cache) for token_cache in _token_caches.values())
+    metrics["total_ms"] = metrics.pop("seconds") * 1000
+    metrics["avg_ms_per_input"] = metrics["total_ms"] / metrics["inputs"] if metrics["inputs"] else 0.0
+    return metrics
+
+def generate_batch(model, input_texts: list) -> list:
+    """
+    Answer a batch of queued questions with one tokenizer call and one forward pass.
+    Each input text should be in the format: "question: [question] context: [context]"
     
     Args:
         model (tuple): The loaded model and tokenizer
-        input_text (str): The input text containing question and context
+        input_texts (list): The input texts containing question and context
     
     Returns:
-        str: The answer to the question
+        list: The answer to each question
     """
     model, tokenizer = model  # Unpack the model and tokenizer
     
-    # Parse input text
-    try:
-        question, context = input_text.split("context:", 1)
-        question = question.replace("question:", "").strip()
-        context = context.strip()
-    except ValueError:
-        return "Error: Input must be in format 'question: [question] context: [context]'"
+    # Parse input texts
+    responses = [None] * len(input_texts)
+    parsed = []
+    for i, input_text in enumerate(input_texts):
+        try:
+            parsed.append((i, *_parse_input(input_text)))
+        except ValueError:
+            responses[i] = "Error: Input must be in format 'question: [question] context: [context]'"
+    
+    if not parsed:
+        return responses
     
     # Tokenize input
-    inputs = tokenizer(
-        question,
-        context,
-        return_tensors="pt",
-        padding=True,
-        truncation=True,
+    encodings = tokenize_batch(
+        tokenizer,
+        [question for _, question, _ in parsed],
+        [context for _, _, context in parsed],
         max_length=512,
-        add_special_tokens=True,
         return_offsets_mapping=True
     )
-    
-    # Move inputs to GPU if available
-    if torch.cuda.is_available():
-        inputs = {k: v.to("cuda") for k, v in inputs.items()}
+    inputs = collate(tokenizer, encodings)
     
     # Get predictions
     with torch.no_grad(), torch.amp.autocast('cuda'):
         outputs = model(**inputs)
-        start_logits = outputs.start_logits
-        end_logits = outputs.end_logits
+        padding_mask = inputs["attention_mask"] == 0
+        start_logits = outputs.start_logits.float().masked_fill(padding_mask, float("-inf"))
+        end_logits = outputs.end_logits.float().masked_fill(padding_mask, float("-inf"))
     
     # Get the most likely start and end positions
-    start_idx = torch.argmax(start_logits)
-    end_idx = torch.argmax(end_logits)
-    
-    # Get the answer span
-    answer_start = inputs["offset_mapping"][0][start_idx][0].item()
-    answer_end = inputs["offset_mapping"][0][end_idx][1].item()
-    
-    # Extract the answer
-    answer = context[answer_start:answer_end]
+    start_probs = torch.nn.functional.softmax(start_logits, dim=-1)
+    end_probs = torch.nn.functional.softmax(end_logits, dim=-1)
+    start_scores, start_indices = start_probs.max(dim=-1)
+    end_scores, end_indices = end_probs.max(dim=-1)
+    
+    for row, (i, question, context) in enumerate(parsed):
+        offset_mapping = encodings[row]["offset_mapping"]
+        
+        # Get the answer span
+        answer_start = offset_mapping[start_indices[row].item()][0]
+        answer_end = offset_mapping[end_indices[row].item()][1]
+        
+        # Extract the answer
+        answer = context[answer_start:answer_end]
+        
+        # Get confidence scores
+        confidence = (start_scores[row].item() + end_scores[row].item()) / 2
+        
+        responses[i] = f"Question: {question}\nContext: {context}\nAnswer: {answer}\nConfidence: {confidence:.2%}"
+    
+    return responses
+
+def generate(model, input_text: str) -> str:
+    """
+    Answer questions based on the input text.
+    The input text should be in the format: "question: [question] context: [context]"
     
-    # Get confidence scores
-    start_score = torch.nn.functional.softmax(start_logits, dim=-1)[0][start_idx].item()
-    end_score = torch.nn.functional.softmax(end_logits, dim=-1)[0][end_idx].item()
-    confidence = (start_score + end_score) / 2
+    Args:
+        model (tuple): The loaded model and tokenizer
+        input_text (str): The input text containing question and context
     
-    return f"Question: {question}\nContext: {context}\nAnswer: {answer}\nConfidence: {confidence:.2%}" 
\ No newline at end of file
+    Returns:
+        str: The answer to the question
+    """
+    return generate_batch(model, [input_text])[0]
@@ -1,6 +1,13 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, StoppingCriteriaList
+import time
 import torch
 
+# Maximum total sequence length (prompt and generated tokens)
+MAX_SEQUENCE_LENGTH = 2048
+
+# Number of new tokens generated when the request doesn't set max_new_tokens
+DEFAULT_MAX_NEW_TOKENS = 100
+
 def load_model(model_name: str, model_revision: str):
     """
     Load the model and tokenizer from Hugging Face.
@@ -42,53 +49,182 @@ def load_model(model_name: str, model_revision: str):
     
     return model, tokenizer
 
-def generate(model_tuple, input_text: str) -> str:
+class StopStringCriteria(StoppingCriteria):
     """
-    Generate text using the loaded model.
+    Stop as soon as the generated text contains one of the stop strings.
+    New tokens are decoded incrementally and only the tail of the generated
+    text that can contain a new match is searched on each step.
+    """
+    def __init__(self, tokenizer, stop_strings: list, prompt_length: int):
+        self.tokenizer = tokenizer
+        self.stop_strings = stop_strings
+        self.max_stop_length = max(len(stop) for stop in stop_strings)
+        self.prefix_offset = prompt_length
+        self.read_offset = prompt_length
+        self.text = ""
+        self.triggered = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        # Decode from a few tokens back so merged characters and spacing come out right
+        token_ids = input_ids[0, self.prefix_offset:].tolist()
+        prefix_text = self.tokenizer.decode(token_ids[:self.read_offset - self.prefix_offset], skip_special_tokens=True)
+        new_text = self.tokenizer.decode(token_ids, skip_special_tokens=True)
+        
+        # Wait for more tokens while the last one is an incomplete character
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            delta = new_text[len(prefix_text):]
+            self.text += delta
+            self.prefix_offset = self.read_offset
+            self.read_offset = input_ids.shape[1]
+            
+            window = self.text[-(len(delta) + self.max_stop_length - 1):]
+            self.triggered = any(stop in window for stop in self.stop_strings)
+        
+        return torch.full((input_ids.shape[0],), self.triggered, dtype=torch.bool, device=input_ids.device)
+
+class DeadlineCriteria(StoppingCriteria):
+    """
+    Stop once the wall-clock deadline (a time.time() timestamp) has passed.
+    """
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self.triggered = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.triggered = time.time() >= self.deadline
+        return torch.full((input_ids.shape[0],), self.triggered, dtype=torch.bool, device=input_ids.device)
+
+def generate_with_details(
+    model_tuple,
+    input_text: str,
+    max_new_tokens: int = None,
+    stop: list = None,
+    stop_token_ids: list = None,
+    deadline: float = None,
+    repetition_penalty: float = 1.2,
+    no_repeat_ngram_size: int = 3
+) -> dict:
+    """
+    Generate text using the loaded model, stopping at the first of the
+    per-request limits that triggers.
     
     Args:
-        model (tuple): The loaded model and tokenizer
+        model_tuple (tuple): The loaded model and tokenizer
         input_text (str): The input text to generate from
+        max_new_tokens (int, optional): Maximum number of tokens to generate (default 100),
+            capped so the prompt and new tokens fit MAX_SEQUENCE_LENGTH; prompts longer
+            than MAX_SEQUENCE_LENGTH - 1 tokens are truncated from the left
+        stop (list, optional): Stop strings; the completion is cut before the first one
+        stop_token_ids (list, optional): Token ids that end generation in addition to EOS
+        deadline (float, optional): Wall-clock deadline as a time.time() timestamp
+        repetition_penalty (float, optional): Repetition penalty, 1.0 disables it
+        no_repeat_ngram_size (int, optional): Size of n-grams that can't repeat, 0 disables it
     
     Returns:
-        str: The generated text
+        dict: The full text, the completion, the number of new tokens and the
+            stop reason ("eos", "stop_token", "stop_string", "deadline" or "length")
     """
     model, tokenizer = model_tuple  # Unpack the model and tokenizer
+    stop_strings = [s for s in (stop or []) if s]
+    stop_token_ids = list(stop_token_ids or [])
     
     # Tokenize input
     inputs = tokenizer(
         input_text,
         return_tensors="pt",
         padding=True,
-        truncation=True,
-        max_length=2048,
         add_special_tokens=True
     )
     
+    # Truncate long prompts from the left, keeping the end the completion continues from
+    input_ids, attention_mask = inputs["input_ids"], inputs["attention_mask"]
+    max_prompt_length = MAX_SEQUENCE_LENGTH - 1
+    if input_ids.shape[1] > max_prompt_length:
+        if tokenizer.bos_token_id is not None and input_ids[0, 0].item() == tokenizer.bos_token_id:
+            input_ids = torch.cat([input_ids[:, :1], input_ids[:, -(max_prompt_length - 1):]], dim=1)
+            attention_mask = torch.cat([attention_mask[:, :1], attention_mask[:, -(max_prompt_length - 1):]], dim=1)
+        else:
+            input_ids = input_ids[:, -max_prompt_length:]
+            attention_mask = attention_mask[:, -max_prompt_length:]
+    inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+    
     # Move inputs to GPU if available
     if torch.cuda.is_available():
         inputs = {k: v.to("cuda") for k, v in inputs.items()}
     
+    prompt_length = inputs["input_ids"].shape[1]
+    if max_new_tokens is None:
+        max_new_tokens = DEFAULT_MAX_NEW_TOKENS
+    max_new_tokens = max(1, min(max_new_tokens, MAX_SEQUENCE_LENGTH - prompt_length))
+    
+    # Build the stopping criteria for this request
+    stop_string_criteria = StopStringCriteria(tokenizer, stop_strings, prompt_length) if stop_strings else None
+    deadline_criteria = DeadlineCriteria(deadline) if deadline is not None else None
+    stopping_criteria = StoppingCriteriaList(
+        [criteria for criteria in (stop_string_criteria, deadline_criteria) if criteria is not None]
+    )
+    eos_token_ids = [token_id for token_id in [tokenizer.eos_token_id, *stop_token_ids] if token_id is not None] or None
+    
     # Generate output
     with torch.no_grad(), torch.amp.autocast('cuda'):
         outputs = model.generate(
             inputs["input_ids"],
             attention_mask=inputs["attention_mask"],
-            max_length=min(2048, inputs["input_ids"].shape[1] + 100),
+            max_new_tokens=max_new_tokens,
             min_length=1,
             num_return_sequences=1,
             pad_token_id=tokenizer.pad_token_id,
-            eos_token_id=tokenizer.eos_token_id,
+            eos_token_id=eos_token_ids,
+            stopping_criteria=stopping_criteria,
             do_sample=True,
             temperature=0.7,
             top_p=0.9,
             top_k=50,
-            repetition_penalty=1.2,
-            no_repeat_ngram_size=3,
-            early_stopping=True,
+            repetition_penalty=repetition_penalty,
+            no_repeat_ngram_size=no_repeat_ngram_size,
             use_cache=True
         )
     
-    # Decode and return the generated text
+    # Work out which limit ended generation
+    new_token_ids = outputs[0, prompt_length:].tolist()
+    if stop_string_criteria is not None and stop_string_criteria.triggered:
+        stop_reason = "stop_string"
+    elif new_token_ids and new_token_ids[-1] in stop_token_ids:
+        stop_reason = "stop_token"
+    elif new_token_ids and new_token_ids[-1] == tokenizer.eos_token_id:
+        stop_reason = "eos"
+    elif deadline_criteria is not None and deadline_criteria.triggered:
+        stop_reason = "deadline"
+    else:
+        stop_reason = "length"
+    
+    # Decode the generated text, cutting the completion before the first stop string
     output_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    return output_text
\ No newline at end of file
+    completion = tokenizer.decode(new_token_ids, skip_special_tokens=True)
+    cuts = [completion.find(s) for s in stop_strings if s in completion]
+    if cuts:
+        cut = min(cuts)
+        if output_text.endswith(completion[cut:]):
+            output_text = output_text[:len(output_text) - len(completion) + cut]
+        completion = completion[:cut]
+    
+    return {
+        "text": output_text,
+        "completion": completion,
+        "new_tokens": len(new_token_ids),
+        "stop_reason": stop_reason
+    }
+
+def generate(model_tuple, input_text: str, **kwargs) -> str:
+    """
+    Generate text using the loaded model.
+    
+    Args:
+        model (tuple): The loaded model and tokenizer
+        input_text (str): The input text to generate from
+        **kwargs: Per-request limits, see generate_with_details
+    
+    Returns:
+        str: The generated text
+    """
+    return generate_with_details(model_tuple, input_text, **kwargs)["text"]
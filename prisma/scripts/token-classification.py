@@ -1,5 +1,24 @@
 from transformers import AutoModelForTokenClassification, AutoTokenizer
+from collections import OrderedDict
+import hashlib
+import threading
+import time
 import torch
+import weakref
+
+# Maximum number of encodings kept in each tokenizer's cache
+TOKEN_CACHE_SIZE = 4096
+
+# Encodings of recently seen inputs per tokenizer, keyed by content hash (LRU
+# order). Keyed weakly by the tokenizer object, so deployments of different
+# revisions never share token ids and a released tokenizer drops its cache.
+_token_caches = weakref.WeakKeyDictionary()
+
+# Guards the tokenization caches and metrics, which are shared by concurrent requests
+_token_cache_lock = threading.Lock()
+
+# Tokenization metrics, exposed through get_tokenization_metrics()
+_tokenization_metrics = {"calls": 0, "inputs": 0, "cache_hits": 0, "seconds": 0.0}
 
 def load_model(model_name: str, model_revision: str):
     """
@@ -36,53 +55,154 @@ def load_model(model_name: str, model_revision: str):
     
     return model, tokenizer
 
-def generate(model, input_text: str) -> str:
+def _cache_key(text, text_pair, kwargs) -> str:
     """
-    Perform token classification on the input text.
+    Build the cache key for one input from its content and the tokenizer arguments.
+    """
+    digest = hashlib.sha1()
+    for part in (repr(sorted(kwargs.items())), text, text_pair or ""):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def tokenize_batch(tokenizer, input_texts: list, text_pairs: list = None, **kwargs) -> list:
+    """
+    Tokenize a batch of inputs with a single call to the fast tokenizer.
+    Encodings of repeated inputs are served from an LRU cache keyed by content hash.
     
     Args:
-        model (tuple): The loaded model and tokenizer
-        input_text (str): The input text to classify tokens for
+        tokenizer: The loaded fast tokenizer
+        input_texts (list): The input texts to tokenize
+        text_pairs (list, optional): Second sequences to encode with each input
+        **kwargs: Extra arguments forwarded to the tokenizer
     
     Returns:
-        str: The token classification results
+        list: One encoding (dict of token id lists) per input
     """
-    model, tokenizer = model  # Unpack the model and tokenizer
+    start_time = time.perf_counter()
+    pairs = text_pairs if text_pairs is not None else [None] * len(input_texts)
+    keys = [_cache_key(text, pair, kwargs) for text, pair in zip(input_texts, pairs)]
     
-    # Tokenize input
-    inputs = tokenizer(
-        input_text,
-        return_tensors="pt",
-        padding=True,
-        truncation=True,
-        max_length=512,
-        add_special_tokens=True,
-        return_offsets_mapping=True
-    )
+    # Look up cached encodings, collecting the first occurrence of each miss
+    encodings = {}
+    misses = {}
+    cache_hits = 0
+    with _token_cache_lock:
+        token_cache = _token_caches.setdefault(tokenizer, OrderedDict())
+        for i, key in enumerate(keys):
+            encoding = token_cache.get(key)
+            if encoding is not None:
+                token_cache.move_to_end(key)
+                encodings[key] = encoding
+                cache_hits += 1
+            elif key not in misses:
+                misses[key] = i
+    
+    # Encode all misses through the batch API in one call
+    if misses:
+        batch = tokenizer(
+            [input_texts[i] for i in misses.values()],
+            [pairs[i] for i in misses.values()] if text_pairs is not None else None,
+            truncation=True,
+            add_special_tokens=True,
+            **kwargs
+        )
+        for j, key in enumerate(misses):
+            encodings[key] = {name: values[j] for name, values in batch.items()}
+    
+    with _token_cache_lock:
+        for key in misses:
+            token_cache[key] = encodings[key]
+        while len(token_cache) > TOKEN_CACHE_SIZE:
+            token_cache.popitem(last=False)
+        
+        _tokenization_metrics["calls"] += 1
+        _tokenization_metrics["inputs"] += len(keys)
+        _tokenization_metrics["cache_hits"] += cache_hits
+        _tokenization_metrics["seconds"] += time.perf_counter() - start_time
+    
+    return [encodings[key] for key in keys]
+
+def collate(tokenizer, encodings: list) -> dict:
+    """
+    Pad a list of encodings into a batch of tensors.
+    Offset mappings are left out, since they are only needed on the CPU side.
+    
+    Args:
+        tokenizer: The loaded fast tokenizer
+        encodings (list): Encodings returned by tokenize_batch
+    
+    Returns:
+        dict: Padded input tensors for the model
+    """
+    features = [
+        {name: values for name, values in encoding.items() if name != "offset_mapping"}
+        for encoding in encodings
+    ]
+    inputs = tokenizer.pad(features, padding=True, return_tensors="pt")
     
     # Move inputs to GPU if available
     if torch.cuda.is_available():
         inputs = {k: v.to("cuda") for k, v in inputs.items()}
     
+    return inputs
+
+def get_tokenization_metrics() -> dict:
+    """
+    Return the tokenization time and cache statistics collected so far.
+    
+    Returns:
+        dict: Calls, inputs, cache hits and total/average tokenization time in milliseconds
+    """
+    with _token_cache_lock:
+        metrics = dict(_tokenization_metrics)
+        metrics["cache_size"] = sum(len(token_cache) for token_cache in _token_caches.values())
+    metrics["total_ms"] = metrics.pop("seconds") * 1000
+    metrics["avg_ms_per_input"] = metrics["total_ms"] / metrics["inputs"] if metrics["inputs"] else 0.0
+    return metrics
+
+def generate_batch(model, input_texts: list) -> list:
+    """
+    Perform token classification on a batch of queued input texts.
+    
+    Args:
+        model (tuple): The loaded model and tokenizer
+        input_texts (list): The input texts to classify tokens for
+    
+    Returns:
+        list: The token classification results, one per input
+    """
+    model, tokenizer = model  # Unpack the model and tokenizer
+    
+    # Tokenize input
+    encodings = tokenize_batch(tokenizer, input_texts, max_length=512, return_offsets_mapping=True)
+    inputs = collate(tokenizer, encodings)
+    
     # Get predictions
     with torch.no_grad(), torch.amp.autocast('cuda'):
         outputs = model(**inputs)
         logits = outputs.logits
-        predictions = torch.argmax(logits, dim=-1)
-    
-    # Get offset mappings for aligning predictions with original text
-    offset_mapping = inputs["offset_mapping"][0]
+        predictions = torch.argmax(logits, dim=-1).tolist()
     
-    # Process predictions
+    return [
+        _format_entities(model, input_text, preds, encoding["offset_mapping"])
+        for input_text, preds, encoding in zip(input_texts, predictions, encodings)
+    ]
+
+def _format_entities(model, input_text: str, predictions: list, offset_mapping: list) -> str:
+    """
+    Group token predictions for one input into entities, using the offset
+    mappings to align predictions with the original text.
+    """
     results = []
     current_entity = None
     current_text = ""
     
-    for idx, (pred, (start, end)) in enumerate(zip(predictions[0], offset_mapping)):
+    for pred, (start, end) in zip(predictions, offset_mapping):
         if start == 0 and end == 0:  # Skip special tokens
             continue
             
-        label = model.config.id2label[pred.item()]
+        label = model.config.id2label[pred]
         token_text = input_text[start:end]
         
         if label.startswith("B-"):  # Beginning of entity
@@ -103,4 +223,17 @@ def generate(model, input_text: str) -> str:
     if current_entity:
         results.append(f"{current_entity}: {current_text.strip()}")
     
-    return f"Input: {input_text}\nEntities:\n" + "\n".join(results) 
\ No newline at end of file
+    return f"Input: {input_text}\nEntities:\n" + "\n".join(results)
+
+def generate(model, input_text: str) -> str:
+    """
+    Perform token classification on the input text.
+    
+    Args:
+        model (tuple): The loaded model and tokenizer
+        input_text (str): The input text to classify tokens for
+    
+    Returns:
+        str: The token classification results
+    """
+    return generate_batch(model, [input_text])[0]
@@ -13,7 +13,8 @@ const MODEL_TYPES = {
   "summarization": "summarization.py",
   "text-generation": "text-generation-script.py",
   "masked-language-modeling": "masked-language-modeling.py",
-  "image-classification": "image-classification.py"
+  "image-classification": "image-classification.py",
+  "multi-task-encoder": "multi-task-encoder.py"
 } as const
 
 async function main() {
@@ -418,6 +418,7 @@ export function ModelUpload({ addNotification }: ModelUploadProps) {
                         <SelectItem value="text-generation">Text Generation</SelectItem>
                         <SelectItem value="masked-language-modeling">Masked Language Modeling</SelectItem>
                         <SelectItem value="image-classification">Image Classification</SelectItem>
+                        <SelectItem value="multi-task-encoder">Multi-Task Encoder</SelectItem>
                         <SelectItem value="other">Other</SelectItem>
                       </SelectContent>
                     </Select>
@@ -503,6 +504,7 @@ export function ModelUpload({ addNotification }: ModelUploadProps) {
                         <SelectItem value="text-generation">Text Generation</SelectItem>
                         <SelectItem value="masked-language-modeling">Masked Language Modeling</SelectItem>
                         <SelectItem value="image-classification">Image Classification</SelectItem>
+                        <SelectItem value="multi-task-encoder">Multi-Task Encoder</SelectItem>
                         <SelectItem value="other">Other</SelectItem>
                       </SelectContent>
                     </Select>